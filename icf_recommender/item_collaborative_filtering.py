@@ -4,10 +4,19 @@ Item Based Collaborative Filtering
 
 # Author Oni On <oni.on.qepa@gmail.com>
 
-from itertools import permutations
+import weakref
+from types import SimpleNamespace
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+
+# prime modulus of the universal hash functions of the MinHash signatures
+MERSENNE_PRIME = 2 ** 31 - 1
+
+# default number of values evaluated at once when computing the users in common and expected users of item pairs,
+# small enough for the temporaries of a block to stay in the CPU cache
+BLOCK_SIZE = 2 ** 16
 
 
 class ItemCollaborativeFiltering:
@@ -28,6 +37,11 @@ class ItemCollaborativeFiltering:
     ----------
     item_column: str, default='item_id'. The name of the item id column in the dataframe
     user_column: str, default='user_id'. The name of the user id column in the dataframe
+    minhash_size: int, default=None. If set, the number of users in common of the item pairs is estimated from MinHash
+    signatures of this size instead of counted exactly
+    block_size: int, default=BLOCK_SIZE. The number of values evaluated at once when computing item pairs
+    cache: bool, default=False. If True, successive fits of the same dataframe reuse the incidence matrix and the item
+    and user statistics
 
     Examples
     --------
@@ -43,125 +57,287 @@ class ItemCollaborativeFiltering:
 
     Attributes
     ----------
+    incidence: sp.csr_matrix. The (users x items) boolean incidence matrix of the last fitted dataframe
+    items: pd.Index. The items of the incidence matrix columns
+    item_probabilities: np.array. The probability of a user interacting with every item
+    item_users: sp.csc_matrix. The incidence matrix in column format, the users of every item
+    item_signatures: np.array. The MinHash signatures of the users of every item, only set if minhash_size is set
+    user_interactions: np.array. The number of interactions of every user, apart from the paired item
 
     References
     ----------
     https://www.computer.org/csdl/mags/ic/2017/03/mic2017030012.pdf
     """
 
-    def __init__(self, item_column='item_id', user_column='user_id'):
+    def __init__(self, item_column='item_id', user_column='user_id', minhash_size=None, block_size=BLOCK_SIZE,
+                 cache=False):
         """
         :param item_column: str, default='item_id'. The name of the item id column in the input dataframe
         :param user_column: str, default='user_id'. The name of the user id column in the input dataframe
+        :param minhash_size: int, default=None. The size of the MinHash signatures used to estimate the number of users
+        in common of the item pairs, if None - the users in common are counted exactly
+        :param block_size: int, default=BLOCK_SIZE. The number of interactions histogram values (or signature values)
+        evaluated at once when computing the expected users (or estimated users in common) of item pairs. Bounds the
+        memory of the temporaries, larger blocks take fewer iterations
+        :param cache: bool, default=False. If True, successive fit_recommendations() calls with the same dataframe
+        object, shape, columns and minhash_size reuse the incidence matrix and the item and user statistics. The
+        dataframe must not be modified in between, e.g. by assigning a column, unless invalidate_cache() is called
         """
         self.item_column = item_column
         self.user_column = user_column
+        self.minhash_size = minhash_size
+        self.block_size = block_size
+        self.cache = cache
         self.df_recommendations = pd.DataFrame()
+        self.__fitted_df = None
+        self.__fitted_df_key = None
+
+    def invalidate_cache(self):
+        """
+        Forgets the dataframe of the last fit_recommendations() call, so that the next call computes the incidence
+        matrix and the item and user statistics again. Needed if that dataframe has been modified in place
+        """
+        self.__fitted_df = None
+        self.__fitted_df_key = None
 
-    def __generate_item_pairs(self, df, item):
+    def __getstate__(self):
         """
-        Creates permutations/pairs of two products
+        Weak references cannot be pickled: an unpickled instance computes everything again on its first fit
+        """
+        state = self.__dict__.copy()
+        state['_ItemCollaborativeFiltering__fitted_df'] = None
+        return state
+
+    def __fitted_key(self, df):
+        """
+        The parameters the incidence matrix and the item and user statistics of df depend on, apart from its values
         :param df: dataframe with columns [user_id, item_id]
-        :param item: item that is paired with all other items, if None - all possible pairs are created
-        :return: list of tuples, length=df['item'].nunique()
+        :return: tuple
         """
-        if item is not None:
-            return [(item, paired_item) for paired_item in df[self.item_column].unique() if paired_item != item]
-        else:
-            return [(item, paired_item) for
-                    item, paired_item in permutations(df[self.item_column].unique(), 2)]
+        return df.shape, self.item_column, self.user_column, self.minhash_size
 
-    def __calculate_item_users(self, df):
+    def __is_fitted(self, df):
         """
-        Creates a set of the users that interacted (e.g. watched, purchased) with an item
-        Sets self.item_users to dictionary {item1: set(user1, user2, ...), item2: set()...}
+        Checks if caching is enabled and the incidence matrix and the item and user statistics have been computed for
+        df with the current parameters
         :param df: dataframe with columns [user_id, item_id]
+        :return: bool
         """
+        return (
+            self.cache and self.__fitted_df is not None and self.__fitted_df() is df and
+            self.__fitted_df_key == self.__fitted_key(df)
+        )
 
-        item_users = df.groupby(
-            self.item_column
-        ).agg(
-            {
-                self.user_column: lambda x: set(x)
-            }
-        ).to_dict()[self.user_column]
+    @staticmethod
+    def __factorize(column):
+        """
+        Encodes the values of a column as integer codes
+        The values of categorical columns are not hashed again, their integer codes are factorized instead: the values
+        keep their order of appearance, and unused categories are left out
+        :param column: pd.Series
+        :return: (np.array, pd.Index) = (code of every value, unique values)
+        """
+        if isinstance(column.dtype, pd.api.types.CategoricalDtype):
+            codes, uniques = pd.factorize(column.cat.codes.values)
+            return codes, column.cat.categories.take(uniques)
 
-        self.item_users = item_users
+        return pd.factorize(column)
 
-    def __count_common_item_pair_users(self, item_pair):
+    def __calculate_incidence(self, df):
         """
-        Computes the number of users that interacted (e.g. watched, purchased) with BOTH items in a pair
-        :param item_pair: tuple(item1, item2)
-        :return: (tuple, int) = (item_pair, number of users in common for the item pair)
+        Creates the (users x items) incidence matrix U of the interactions, U[u, i] = 1 if user u interacted (e.g.
+        watched, purchased) with item i. Users and items are indexed in their order of appearance in df
+        Sets self.incidence to the incidence matrix (sp.csr_matrix) and self.items to the items of its columns
+        (pd.Index)
+        Sets self.item_users to the incidence matrix in sp.csc_matrix format, to look up the users of an item
+        :param df: dataframe with columns [user_id, item_id]
         """
-        item1, item2 = item_pair
-        try:
-            item1_users = self.item_users[item1]
-            item2_users = self.item_users[item2]
-            common_users_count = len(item1_users.intersection(item2_users))
-            return item_pair, common_users_count
-        except AttributeError:
-            "Extract item users first, using __item_users()"
+        item_codes, items = self.__factorize(df[self.item_column])
+        user_codes, users = self.__factorize(df[self.user_column])
 
-    def __calculate_item_probabilities(self, df):
+        # boolean values: repeated interactions of a user with an item are summed to True, so counted once
+        incidence = sp.csr_matrix(
+            (np.ones(len(df), dtype=bool), (user_codes, item_codes)),
+            shape=(len(users), len(items))
+        )
+        incidence.sum_duplicates()
+
+        self.incidence = incidence
+        self.items = items
+        self.item_users = incidence.tocsc()
+
+    def __item_users(self, item_index):
         """
-        Computes the probability of a user interacting with an item (e.g. watching, purchasing, liking)
-        Sets self.item_probabilities to dictionary with key=item_id, value = interaction probability (float)
-        :param df:  dataframe with columns [user_id, item_id]
+        Looks up the users that interacted (e.g. watched, purchased) with an item
+        :param item_index: index of the item
+        :return: np.array, indices of the users of the item
         """
-        item_probabilities = (df.groupby(
-            self.item_column
-        ).agg(
-            {
-                self.user_column: 'nunique'
-            }
-        )/df[self.user_column].nunique()).to_dict()[self.user_column]
+        start, end = self.item_users.indptr[item_index], self.item_users.indptr[item_index + 1]
+        return self.item_users.indices[start:end]
 
-        self.item_probabilities = item_probabilities
+    def __count_common_item_pair_users(self, item_index=None):
+        """
+        Computes the number of users that interacted (e.g. watched, purchased) with BOTH items in a pair, for all the
+        item pairs with at least 1 user in common
+
+        The co-occurrence matrix C = U.T @ U of the incidence matrix U holds the number of users in common for every
+        item pair: C[i, j] = |users(i) & users(j)|. Item pairs with no users in common are the zeros of the sparse
+        matrix C.
+        :param item_index: index of the item that is paired with all other items, if None - all possible pairs are
+        counted
+        :return: (np.array, np.array, np.array) = (item1 indices, item2 indices, number of users in common)
+        """
+        if item_index is not None:
+            return self.__count_common_item_users(item_index)
+
+        # item pairs in the order of appearance of the items in df: row major with sorted columns
+        user_item = self.incidence.astype(np.uint32)
+        co_occurrence = (user_item.T @ user_item).tocsr()
+        co_occurrence.sort_indices()
+        co_occurrence = co_occurrence.tocoo()
+
+        keep = (co_occurrence.row != co_occurrence.col) & (co_occurrence.data > 0)
+
+        return co_occurrence.row[keep], co_occurrence.col[keep], co_occurrence.data[keep]
 
-    def __item_interaction_probability(self, item):
+    def __count_common_item_users(self, item_index):
         """
-        Looks up the probability of a user interacting with an item (e.g. watching, purchasing, liking)
-        :param item: item_id
-        :return: float, probability
+        Computes the number of users in common of ONE item with all other items, for the items with at least 1 user
+        in common. Only the row of the item in the co-occurrence matrix is computed: the items of the users of the
+        item are counted, which touches the interactions of these users instead of the whole incidence matrix
+        :param item_index: index of the item that is paired with all other items, -1 if the item is unknown
+        :return: (np.array, np.array, np.array) = (item1 indices, item2 indices, number of users in common)
         """
-        try:
-            return self.item_probabilities[item]
-        except AttributeError:
-            "Extract item probabilities first, using __item_probabilities()"
+        if item_index < 0:
+            no_pairs = np.array([], dtype=np.int64)
+            return no_pairs, no_pairs, no_pairs
+
+        item_users = self.__item_users(item_index)
+
+        counts = np.bincount(self.incidence[item_users].indices, minlength=self.incidence.shape[1])
+        counts[item_index] = 0
+
+        cols = np.flatnonzero(counts)
+
+        return np.full(len(cols), item_index), cols, counts[cols].astype(np.uint32)
 
-    def __calculate_user_interactions(self, df):
+    def __calculate_item_signatures(self):
         """
-        For ALL users computes the number of items that every user interacted with, APART from item in the df row
-        Sets self.user_interactions to a dictionary with key = user_id, value = number of interactions
-        :param df: dataframe with columns [user_id, item_id]
+        Computes the MinHash signature of the users of every item: for minhash_size random hash functions of the
+        users h(u) = (a * u + b) mod MERSENNE_PRIME, the minimum hash value over the users of the item
+        Sets self.item_signatures to an array of shape (items, minhash_size)
         """
+        random_state = np.random.RandomState(0)
+        a = random_state.randint(1, MERSENNE_PRIME, size=self.minhash_size).astype(np.int64)
+        b = random_state.randint(0, MERSENNE_PRIME, size=self.minhash_size).astype(np.int64)
 
-        # subtract 1 to count number of interactions with other items DIFFERENT from item
-        interactions_count = df.groupby(
-            self.user_column
-        )[self.item_column].agg('nunique') - 1
+        users = self.item_users.indices.astype(np.int64)
+        has_users = np.diff(self.item_users.indptr) > 0
+        starts = self.item_users.indptr[:-1][has_users]
 
-        self.user_interactions = interactions_count.to_dict()
+        item_signatures = np.full((self.item_users.shape[1], self.minhash_size), MERSENNE_PRIME, dtype=np.int32)
+        for k in range(self.minhash_size):
+            hashes = (a[k] * users + b[k]) % MERSENNE_PRIME
+            item_signatures[has_users, k] = np.minimum.reduceat(hashes, starts)
 
-    def __count_users_interactions(self, df, item):
+        self.item_signatures = item_signatures
+
+    def __estimate_common_item_pair_users(self, item_index=None):
         """
-        For ALL users of an item, it looks up the number of other items that every user interacted with, APART from item
-        :param df: dataframe with columns [user_id, item_id]
-        :param item: the item_id to be looked up
-        :return: array of integers with number of interactions per user. length = nr of users that interacted with item.
+        Estimates the number of users that interacted (e.g. watched, purchased) with BOTH items in a pair from the
+        MinHash signatures of the items, for all the item pairs with at least 1 equal signature value
+
+        The fraction of equal signature values estimates the Jaccard similarity J = |A & B| / |A | B| of the users A
+        and B of the two items, then |A & B| = J * (|A| + |B|) / (1 + J). Signatures take O(items x minhash_size)
+        memory, whatever the number of item pairs with users in common.
+        :param item_index: index of the item that is paired with all other items, if None - all possible pairs are
+        counted
+        :return: (np.array, np.array, np.array) = (item1 indices, item2 indices, estimated number of users in common)
         """
+        item_users_count = np.diff(self.item_users.indptr)
+        n_items = len(item_users_count)
+
+        if n_items == 0 or item_index is not None and item_index < 0:
+            no_pairs = np.array([], dtype=np.int64)
+            return no_pairs, no_pairs, no_pairs.astype(np.float32)
+
+        if item_index is not None:
+            matches = (self.item_signatures[item_index] == self.item_signatures).sum(axis=1)
+            matches[item_index] = 0
+
+            cols = np.flatnonzero(matches)
+            rows = np.full(len(cols), item_index)
+            matches = matches[cols]
+        else:
+            block_size = max(1, self.block_size // (n_items * self.minhash_size))
 
-        try:
-            filtered_users = df.loc[df[self.item_column] == item, self.user_column].values
-            interactions_count = np.array([self.user_interactions[user] for user in filtered_users])
-            return interactions_count
-        except AttributeError:
-            "Extract user interactions first, using __user_interactions()"
+            rows, cols, matches = [], [], []
+            for start in range(0, n_items, block_size):
+                # the signatures are symmetric: items of the block are compared with the items after them only
+                block_matches = np.triu((
+                    self.item_signatures[start:start + block_size, None, :] ==
+                    self.item_signatures[None, start:, :]
+                ).sum(axis=2), k=1)
 
-    def __expected_common_item_pair_users(self, df, item_pair):
+                block_rows, block_cols = np.nonzero(block_matches)
+                rows.append(block_rows + start)
+                cols.append(block_cols + start)
+                matches.append(block_matches[block_rows, block_cols])
+
+            rows, cols, matches = np.concatenate(rows), np.concatenate(cols), np.concatenate(matches)
+
+            # (item2, item1) has the users in common of (item1, item2)
+            rows, cols = np.concatenate([rows, cols]), np.concatenate([cols, rows])
+            matches = np.concatenate([matches, matches])
+
+        jaccard = matches.astype(np.float32) / self.minhash_size
+
+        counts = jaccard * (item_users_count[rows] + item_users_count[cols]) / (1 + jaccard)
+
+        return rows, cols, counts.astype(np.float32)
+
+    def __calculate_item_probabilities(self):
+        """
+        Computes the probability of a user interacting with an item (e.g. watching, purchasing, liking)
+        Sets self.item_probabilities to an array with the interaction probability (float) of every item, in the order
+        of the incidence matrix columns
+        """
+        # the incidence matrix holds one entry per (user, item) pair, so counting the column indices counts the users
+        item_users_count = np.bincount(self.incidence.indices, minlength=self.incidence.shape[1])
+
+        self.item_probabilities = (item_users_count / self.incidence.shape[0]).astype(np.float32)
+
+    def __calculate_user_interactions(self):
+        """
+        For ALL users computes the number of items that every user interacted with, APART from item in the df row
+        Sets self.user_interactions to an array with the number of interactions of every user, in the order of the
+        incidence matrix rows
+        """
+        # the number of items of a user is the number of entries in its incidence matrix row
+        # subtract 1 to count number of interactions with other items DIFFERENT from item
+        self.user_interactions = (np.diff(self.incidence.indptr) - 1).astype(np.int32)
+
+    @staticmethod
+    def __interaction_probabilities(interactions, product_probabilities):
+        """
+        Computes F[n, j] = 1 - (1-pj)^n, the probability of a user with n interactions interacting with item j
+        F is computed in float32 as -expm1(n * log1p(-pj)): log1p(-pj) is computed once per item j, then one expm1 per
+        (n, j), which is accurate for small probabilities pj
+        :param interactions: np.array, the numbers of interactions n
+        :param product_probabilities: np.array, interaction probabilities pj of the items j
+        :return: np.array, shape (len(interactions), len(product_probabilities))
         """
-        item_pair consists of (item1, item2)
+        interactions = interactions.astype(np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            interaction_probabilities = -np.expm1(interactions[:, None] * np.log1p(-product_probabilities)[None, :])
+        # (1-pj)^0 = 1, also for items with pj = 1 where 0 * log1p(-1) is not a number
+        interaction_probabilities[interactions == 0] = 0
+
+        return interaction_probabilities
+
+    def __expected_common_item_pair_users(self, item1_index, item2_index, item_index=None):
+        """
+        For every item pair (item1, item2):
 
         For users of item 1, it computes the EXPECTED number of users who interact (e.g. watch, purchase) with BOTH
         item1 and item2
@@ -180,74 +356,142 @@ class ItemCollaborativeFiltering:
         - the expected value of the above expression for ALL users is sum[1 - (1-p2)^interactions_count], where the sum
         is taken across all users that interacted with item1
 
-        :param df: dataframe with columns [user_id, item_id]
-        :param item_pair: tuple(item1, item2)
-        :return: float, expected number of users in common for the item pair (item1, item2)
+        Computed for all item pairs at once: with H[i, n] the number of users of item i with n interactions and
+        F[n, j] = 1 - (1-pj)^n, the expected number of users in common for (item i, item j) is (H @ F)[i, j]
+        F is computed once, and only the pairs are evaluated: H[i] @ F[:, j] is the sum of H[i, n] * F[n, j] over the
+        nonzero values of H[i]. Pairs are evaluated in blocks of about block_size histogram values
+        H and F only hold the numbers of interactions n that some user has, not all n up to the maximum
+
+        :param item1_index: np.array, indices of item1 of the item pairs
+        :param item2_index: np.array, indices of item2 of the item pairs
+        :param item_index: index of the item, if all item pairs pair ONE item with other items: only the histogram of
+        the users of this item is computed
+        :return: np.array, expected number of users in common for every item pair (item1, item2)
         """
+        if len(item1_index) == 0:
+            return np.array([], dtype=np.float32)
+
+        # interactions[interactions_count[u]] is the number of interactions of user u
+        interactions, interactions_count = np.unique(self.user_interactions, return_inverse=True)
+
+        if item_index is not None:
+            # H[item, n] = number of users of the item with n interactions
+            interactions_histogram = np.bincount(
+                interactions_count[self.__item_users(item_index)], minlength=len(interactions)
+            ).astype(np.float32)
+            return interactions_histogram @ self.__interaction_probabilities(
+                interactions, self.item_probabilities[item2_index]
+            )
+
+        # H[i, n] = number of users of item i with n interactions
+        user_item = self.incidence.tocoo()
+        interactions_histogram = sp.csr_matrix(
+            (np.ones(user_item.nnz, dtype=np.float32), (user_item.col, interactions_count[user_item.row])),
+            shape=(self.incidence.shape[1], len(interactions))
+        )
 
-        item1, item2 = item_pair
+        interaction_probabilities = self.__interaction_probabilities(interactions, self.item_probabilities)
 
-        product_probability = self.__item_interaction_probability(item2)
+        expected_users = np.empty(len(item1_index), dtype=np.float32)
 
-        interactions_count = self.__count_users_interactions(df, item1)
+        # blocks are cut at the pairs where the cumulative number of histogram values of item1 crosses a multiple of
+        # block_size: long-tail items have few users, so their histogram rows hold few of the len(interactions) values
+        pair_values = np.cumsum(np.diff(interactions_histogram.indptr)[item1_index], dtype=np.int64)
+        block_ends = np.searchsorted(pair_values, np.arange(self.block_size, pair_values[-1], self.block_size))
+        block_starts = np.unique(np.concatenate([[0], block_ends]))
+        block_ends = np.append(block_starts[1:], len(item1_index))
 
-        return np.sum(1 - (1 - product_probability) ** interactions_count)
+        for start, end in zip(block_starts, block_ends):
+            block = slice(start, end)
+            block_histogram = interactions_histogram[item1_index[block]].tocoo()
+
+            # H[i, n] * F[n, j] for the nonzero values H[i, n] of the pairs (i, j), summed per pair
+            block_expected_users = block_histogram.data * interaction_probabilities[
+                block_histogram.col, item2_index[block][block_histogram.row]
+            ]
+            expected_users[block] = np.bincount(
+                block_histogram.row, weights=block_expected_users, minlength=len(item1_index[block])
+            )
+
+        return expected_users
 
     @staticmethod
     def __recommendations_score_function(expected_users, actual_users):
         """
         Given the actual and expected users of two items, it computes how related the items are
+        The score (actual_users - expected_users) * log(actual_users + 0.1) / sqrt(expected_users) is computed in place
         :param expected_users: np.array
         :param actual_users: np.array
         :return:
         """
-        return (actual_users - expected_users) * np.log(actual_users + 0.1) / np.sqrt(expected_users)
+        score = actual_users - expected_users
+
+        weight = actual_users + 0.1
+        np.log(weight, out=weight)
+        score *= weight
+
+        # expected users are clamped to the smallest positive float, so that no pair divides by sqrt(0)
+        np.maximum(expected_users, np.finfo(weight.dtype).tiny, out=weight)
+        np.sqrt(weight, out=weight)
+        score /= weight
 
-    def fit_recommendations(self, df, item=None):
+        return score
+
+    def fit_recommendations(self, df, item=None, as_dataframe=True):
         """
         Computes recommendation strength for item pairs
         By default item=None, means recommendations are computed for all items
+        If cache is set, successive calls with the same df reuse the incidence matrix and the item and user
+        statistics, call invalidate_cache() if df is modified in place between calls
         :param df: dataframe with columns [user_id, item_id]
         :param item: item that is scored with all other items, if None - all possible item pairs are scored
-        :return: dataframe with columns [item, recommended_item, actual_common_users, expected_common_users, score]
+        :param as_dataframe: bool, default=True. If False, the columns are returned as numpy arrays, the attributes of
+        a SimpleNamespace, which skips building the dataframe
+        :return: dataframe with columns [item, recommended_item, count_common_users, expected_common_users, score],
+        or if as_dataframe is False a SimpleNamespace with these columns as np.array attributes. count_common_users
+        holds int64 counts, or float32 estimates if minhash_size is set
         """
-        item_pairs = self.__generate_item_pairs(df, item)
-
-        self.__calculate_item_users(df)
-        self.__calculate_item_probabilities(df)
-        self.__calculate_user_interactions(df)
+        if not self.__is_fitted(df):
+            self.__calculate_incidence(df)
+            self.__calculate_item_probabilities()
+            self.__calculate_user_interactions()
+            if self.minhash_size is not None:
+                self.__calculate_item_signatures()
 
-        # output: [((item1, item2), common_users)]
-        count_pair_users = [self.__count_common_item_pair_users(item_pair) for item_pair in item_pairs]
+            self.__fitted_df = weakref.ref(df)
+            self.__fitted_df_key = self.__fitted_key(df)
 
-        # filter out item pairs with no users in common
-        count_pair_users = list(
-           filter(
-               lambda x: x[1] > 0,
-               count_pair_users
-           )
-        )
+        item_index = None if item is None else self.items.get_indexer([item])[0]
 
-        # extract item pair, and user count
-        filtered_item_pairs, count_pair_users = zip(*count_pair_users)
+        # item pairs with at least 1 user in common
+        if self.minhash_size is None:
+            item1_index, item2_index, count_pair_users = self.__count_common_item_pair_users(item_index)
+        else:
+            item1_index, item2_index, count_pair_users = self.__estimate_common_item_pair_users(item_index)
 
-        # output: [expected_users]
-        # compute expected users for item pairs with at least 1 user in common
-        expected_pair_users = [self.__expected_common_item_pair_users(df, item_pair)
-                               for item_pair in filtered_item_pairs]
+        # expected users for item pairs with at least 1 user in common
+        expected_pair_users = self.__expected_common_item_pair_users(item1_index, item2_index, item_index)
 
         # recommendation score function
-        pair_score = self.__recommendations_score_function(np.array(expected_pair_users), np.array(count_pair_users))
+        pair_score = self.__recommendations_score_function(expected_pair_users, count_pair_users.astype(np.float32))
 
-        items, recommended_items = zip(*filtered_item_pairs)
+        # the counts are accumulated in uint32, the output column is int64 so that arithmetic on it does not wrap around
+        if self.minhash_size is None:
+            count_pair_users = count_pair_users.astype(np.int64, copy=False)
 
-        df_recommendations = pd.DataFrame({
-            'item': items,
-            'recommended_item': recommended_items,
+        recommendations = {
+            'item': self.items.values.take(item1_index),
+            'recommended_item': self.items.values.take(item2_index),
             'count_common_users': count_pair_users,
             'expected_common_users': expected_pair_users,
             'score': pair_score
-        })
+        }
+
+        if not as_dataframe:
+            return SimpleNamespace(**recommendations)
+
+        # the columns are typed numpy arrays, so pandas keeps their dtypes instead of inferring them from Python objects
+        df_recommendations = pd.DataFrame(recommendations, copy=False)
 
         return df_recommendations
 
@@ -255,18 +499,30 @@ class ItemCollaborativeFiltering:
     def recommend(df_recommendations, item, n_recommendations=10):
         """
         Returns item recommendations
-        :param df_recommendations: dataframe with recommendations generated with fit_recommendations()
+        :param df_recommendations: dataframe (or SimpleNamespace of arrays) with recommendations generated with
+        fit_recommendations()
         :param item: the item for which recommendations are generated
         :param n_recommendations: the number of generated recommendations
         :return: list of recommended products
         """
+        if isinstance(df_recommendations, pd.DataFrame):
+            items = df_recommendations['item'].values
+            scores = df_recommendations['score'].values
+            recommended_items = df_recommendations['recommended_item'].values
+        else:
+            items = df_recommendations.item
+            scores = df_recommendations.score
+            recommended_items = df_recommendations.recommended_item
 
-        recommended_items = df_recommendations[df_recommendations.item == item]
-        recommended_items = recommended_items.sort_values(
-            'score', ascending=False
-        ).groupby(
-            'item'
-        ).head(n_recommendations)['recommended_item'].values
-        return recommended_items
+        is_item = items == item
+        scores = scores[is_item]
+        recommended_items = recommended_items[is_item]
 
+        # the top n_recommendations scores are selected in linear time, only these are sorted
+        if len(scores) > n_recommendations:
+            top = np.argpartition(-scores, n_recommendations)[:n_recommendations]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='mergesort')]
 
+        return recommended_items[top]
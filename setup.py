@@ -20,7 +20,8 @@ setuptools.setup(
     ],
     install_requires=[
         'numpy==1.15.4',
-        'pandas==0.23.4'
+        'pandas==0.23.4',
+        'scipy==1.1.0'
     ],
     python_requires='>=3'
 )
@@ -29,15 +29,129 @@ class TestItemItemCollaborativeFiltering(unittest.TestCase):
             (recommendations.count_common_users.values == np.array([2, 2])).all(),
             msg="__count_common_item_pair_users() - unexpected results"
         )
+        self.assertEqual(
+            recommendations.count_common_users.dtype, np.int64,
+            msg="Recommendations dataframe 'count_common_users' column type not as expected"
+        )
         self.assertTrue(
-            (recommendations.expected_common_users.values == np.array([6/5, 8/5])).all(),
+            np.allclose(recommendations.expected_common_users.values, np.array([6/5, 8/5])),
             msg="__expected_common_item_pair_users() - unexpected results"
         )
         self.assertTrue(
-            (recommendations.score.values.round(4) == np.array([0.5418, 0.2346])).all(),
+            np.allclose(recommendations.score.values, np.array([0.5418, 0.2346]), atol=5e-5),
             msg="recommendations scores - unexpected results"
         )
 
+    def test_fit_recommendations_item(self):
+        df = pd.DataFrame({'item_id': ['A', 'A', 'A', 'A', 'B', 'B', 'B', 'C', 'C'],
+                           'user_id': [1, 2, 3, 4, 1, 2, 5, 2, 5]})
+
+        recommendations = self.item_collaborative_filtering.fit_recommendations(df)
+        item_recommendations = self.item_collaborative_filtering.fit_recommendations(df, item='B')
+
+        pd.testing.assert_frame_equal(
+            item_recommendations,
+            recommendations[recommendations.item == 'B'].reset_index(drop=True),
+            obj="fit_recommendations(item=...) - unexpected results"
+        )
+
+    def test_fit_recommendations_categorical(self):
+        df = pd.DataFrame({'item_id': ['A', 'A', 'A', 'A', 'B', 'B', 'B', 'C', 'C'],
+                           'user_id': [1, 2, 3, 4, 1, 2, 5, 2, 5]})
+        df_categorical = df.assign(item_id=pd.Categorical(df.item_id, categories=['D', 'C', 'B', 'A']))
+
+        for item in [None, 'B']:
+            pd.testing.assert_frame_equal(
+                ItemCollaborativeFiltering().fit_recommendations(df_categorical, item=item),
+                ItemCollaborativeFiltering().fit_recommendations(df, item=item),
+                obj="fit_recommendations() - unexpected results for a categorical item column"
+            )
+
+    def test_fit_recommendations_minhash(self):
+        df = pd.DataFrame({'item_id': ['A', 'A', 'A', 'A', 'B', 'B', 'B'],
+                           'user_id': [1, 2, 3, 4, 1, 2, 5]})
+
+        recommendations = ItemCollaborativeFiltering(minhash_size=512).fit_recommendations(df)
+
+        self.assertTrue(
+            (recommendations.recommended_item.values == np.array(['B', 'A'])).all(),
+            msg="Recommendations dataframe 'recommended_item' column values not as expected"
+        )
+        self.assertTrue(
+            np.allclose(recommendations.count_common_users.values, np.array([2, 2]), atol=0.5),
+            msg="__estimate_common_item_pair_users() - unexpected results"
+        )
+
+    def test_fit_recommendations_block_size(self):
+        # users with 1 to 30 interactions, so that the interactions histograms have many distinct counts
+        random_state = np.random.RandomState(0)
+        user_ids = np.repeat(np.arange(30), np.arange(1, 31))
+        df = pd.DataFrame({'item_id': random_state.randint(0, 40, len(user_ids)),
+                           'user_id': user_ids})
+
+        recommendations = self.item_collaborative_filtering.fit_recommendations(df)
+        block_recommendations = ItemCollaborativeFiltering(block_size=7).fit_recommendations(df)
+
+        pd.testing.assert_frame_equal(
+            block_recommendations, recommendations,
+            obj="fit_recommendations() - unexpected results with a small block_size"
+        )
+
+    def test_fit_recommendations_empty(self):
+        df = pd.DataFrame({'item_id': pd.Series([], dtype=object),
+                           'user_id': pd.Series([], dtype=np.int64)})
+
+        for recommender in [self.item_collaborative_filtering, ItemCollaborativeFiltering(minhash_size=16)]:
+            recommendations = recommender.fit_recommendations(df)
+            self.assertTrue(
+                recommendations.empty,
+                msg="fit_recommendations() - unexpected results for an empty dataframe"
+            )
+
+    def test_fit_recommendations_cache(self):
+        df = pd.DataFrame({'item_id': ['A', 'A', 'A', 'A', 'B', 'B', 'B'],
+                           'user_id': [1, 2, 3, 4, 1, 2, 5]})
+
+        item_collaborative_filtering = ItemCollaborativeFiltering(cache=True)
+        recommendations = item_collaborative_filtering.fit_recommendations(df)
+        incidence = item_collaborative_filtering.incidence
+
+        item_recommendations = item_collaborative_filtering.fit_recommendations(df, item='A')
+        self.assertIs(
+            item_collaborative_filtering.incidence, incidence,
+            msg="fit_recommendations() - incidence matrix not reused for the same dataframe"
+        )
+        pd.testing.assert_frame_equal(item_recommendations, recommendations[recommendations.item == 'A'])
+
+        item_collaborative_filtering.minhash_size = 16
+        item_collaborative_filtering.fit_recommendations(df)
+        self.assertIsNot(
+            item_collaborative_filtering.incidence, incidence,
+            msg="fit_recommendations() - incidence matrix not recomputed after changing minhash_size"
+        )
+
+        incidence = item_collaborative_filtering.incidence
+        df.loc[df.user_id == 5, 'item_id'] = 'A'
+        item_collaborative_filtering.invalidate_cache()
+        item_collaborative_filtering.fit_recommendations(df)
+        self.assertIsNot(
+            item_collaborative_filtering.incidence, incidence,
+            msg="invalidate_cache() - incidence matrix not recomputed"
+        )
+
+    def test_fit_recommendations_no_cache(self):
+        df = pd.DataFrame({'item_id': ['A', 'A', 'A', 'A', 'B', 'B', 'B'],
+                           'user_id': [1, 2, 3, 4, 1, 2, 5]})
+
+        self.item_collaborative_filtering.fit_recommendations(df)
+
+        df['user_id'] = [1, 2, 3, 4, 5, 6, 7]
+        recommendations = self.item_collaborative_filtering.fit_recommendations(df)
+        self.assertTrue(
+            recommendations.empty,
+            msg="fit_recommendations() - results not recomputed after assigning a column"
+        )
+
     def test_recommend(self):
         df = pd.DataFrame({'item_id': ['A', 'A', 'A', 'A', 'B', 'B', 'B'],
                            'user_id': [1, 2, 3, 4, 1, 2, 5]})
@@ -50,5 +164,41 @@ class TestItemItemCollaborativeFiltering(unittest.TestCase):
             msg="unexpected results from recommend()"
         )
 
+    def test_recommend_top(self):
+        df_recommendations = pd.DataFrame({'item': ['A', 'B', 'A', 'A', 'B', 'A'],
+                                           'recommended_item': ['C', 'A', 'E', 'B', 'C', 'D'],
+                                           'score': [0.2, 0.9, 0.5, 0.1, 0.3, 0.4]})
+
+        top_recommendations = self.item_collaborative_filtering.recommend(df_recommendations, 'A', n_recommendations=3)
+        self.assertTrue(
+            (top_recommendations == np.array(['E', 'D', 'C'])).all(),
+            msg="unexpected results from recommend() with n_recommendations"
+        )
+
+        top_recommendations = self.item_collaborative_filtering.recommend(df_recommendations, 'B')
+        self.assertTrue(
+            (top_recommendations == np.array(['A', 'C'])).all(),
+            msg="unexpected results from recommend() with fewer recommendations than n_recommendations"
+        )
+
+    def test_fit_recommendations_arrays(self):
+        df = pd.DataFrame({'item_id': ['A', 'A', 'A', 'A', 'B', 'B', 'B'],
+                           'user_id': [1, 2, 3, 4, 1, 2, 5]})
+
+        df_recommendations = self.item_collaborative_filtering.fit_recommendations(df)
+        recommendations = self.item_collaborative_filtering.fit_recommendations(df, as_dataframe=False)
+
+        for column in df_recommendations.columns:
+            self.assertTrue(
+                (np.asarray(getattr(recommendations, column)) == df_recommendations[column].values).all(),
+                msg="fit_recommendations(as_dataframe=False) - unexpected '{}' values".format(column)
+            )
+
+        top_recommendations = self.item_collaborative_filtering.recommend(recommendations, 'A')
+        self.assertTrue(
+            top_recommendations == ['B'],
+            msg="unexpected results from recommend() with array recommendations"
+        )
+
     def tearDown(self):
         pass